@@ -1,14 +1,27 @@
 import os
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pymongo import AsyncMongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+import aiodns
 import httpx
+import orjson
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence
 import asyncio
-from datetime import datetime
+import heapq
+import logging
+import queue
+import secrets
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+from urllib.parse import urlencode
 
-app = FastAPI(title="Worldwide Radio Station API")
+app = FastAPI(title="Worldwide Radio Station API", default_response_class=ORJSONResponse)
 
 # CORS configuration
 app.add_middleware(
@@ -19,18 +32,146 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger JSON responses such as station lists
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
+logger = logging.getLogger(__name__)
+
 # MongoDB connection
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/radio_db')
 
+# Radio-Browser API
+RADIO_BROWSER_URL = "https://de1.api.radio-browser.info"  # Fallback when mirror discovery fails
+RADIO_BROWSER_SRV = "_api._tcp.radio-browser.info"
+MIRROR_PROBE_TIMEOUT = 3.0
+COUNTRY_FETCH_TIMEOUT = 15.0
+UPSTREAM_MAX_CONCURRENCY = 6  # Radio-Browser rate-limits per client IP
+
+# Redis cache for Radio-Browser responses
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+STATIONS_CACHE_TTL = 300  # seconds
+EMPTY_STATIONS_CACHE_TTL = 60  # seconds; shorter for searches that matched nothing
+STATIONS_LOCK_TTL = int(COUNTRY_FETCH_TIMEOUT * 2)  # seconds; must outlive the slowest fetch
+STATIONS_LOCK_POLL_INTERVAL = 0.1  # seconds
+UPSTREAM_ETAG_TTL = 3600  # seconds to keep upstream bodies around for revalidation
+# Delete the refresh lock only if it still holds our token
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# American and African countries served by the API
+AMERICAN_COUNTRIES = ("United States", "Canada", "Mexico", "Brazil", "Argentina", "Chile")
+AFRICAN_COUNTRIES = ("South Africa", "Nigeria", "Kenya", "Ghana", "Egypt", "Morocco", "Ethiopia", "Tanzania", "Uganda", "Zimbabwe")
+ALL_COUNTRIES = AMERICAN_COUNTRIES + AFRICAN_COUNTRIES
+# ISO 3166-1 codes of ALL_COUNTRIES; station records carry Radio-Browser's own
+# country names (e.g. "The United States Of America"), so filter on codes
+ALL_COUNTRY_CODES = frozenset(("US", "CA", "MX", "BR", "AR", "CL", "ZA", "NG", "KE", "GH", "EG", "MA", "ET", "TZ", "UG", "ZW"))
+# Pre-serialized once since the country lists never change at runtime
+COUNTRIES_JSON = orjson.dumps({"american": AMERICAN_COUNTRIES, "african": AFRICAN_COUNTRIES})
+MAX_COUNTRIES_PER_REQUEST = 6  # Limit upstream fan-out to avoid timeouts
+
+# Favorites
+MAX_BULK_FAVORITES = 100
+
+def setup_logging():
+    """Route log records through a queue so stream I/O happens off the event loop thread"""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, stream_handler)
+    logger.handlers = [QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+async def pick_radio_browser_mirror():
+    """Resolve the Radio-Browser mirrors via SRV and return the one that answers fastest"""
+    try:
+        records = await aiodns.DNSResolver().query(RADIO_BROWSER_SRV, "SRV")
+    except aiodns.error.DNSError as e:
+        logger.warning("Radio-Browser SRV lookup failed, using %s: %s", RADIO_BROWSER_URL, e)
+        return RADIO_BROWSER_URL
+    
+    candidates = [f"https://{record.host}" for record in records]
+    async with httpx.AsyncClient(timeout=MIRROR_PROBE_TIMEOUT) as client:
+        
+        async def probe(base_url):
+            response = await client.head(f"{base_url}/json/stats")
+            response.raise_for_status()
+            return base_url
+        
+        # Take the first mirror to respond successfully
+        tasks = [asyncio.create_task(probe(url)) for url in candidates]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    return await next_done
+                except httpx.HTTPError as e:
+                    logger.warning("Radio-Browser mirror probe failed: %s", e)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # Let cancelled probes unwind before the client closes
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    logger.warning("No Radio-Browser mirror responded, using %s", RADIO_BROWSER_URL)
+    return RADIO_BROWSER_URL
+
+async def ensure_favorites_index(favorites):
+    """Drop duplicate (user_id, station_uuid) favorites, then build the unique index on them"""
+    cursor = await favorites.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "station_uuid": "$station_uuid"},
+            "ids": {"$push": "$_id"}
+        }},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ])
+    duplicate_ids = []
+    async for group in cursor:
+        duplicate_ids.extend(group["ids"][1:])  # Keep the first copy of each pair
+    if duplicate_ids:
+        result = await favorites.delete_many({"_id": {"$in": duplicate_ids}})
+        logger.warning("Removed %d duplicate favorites", result.deleted_count)
+    
+    await favorites.create_index(
+        [("user_id", 1), ("station_uuid", 1)],
+        unique=True
+    )
+
 @app.on_event("startup")
 async def startup_db_client():
-    app.mongodb_client = AsyncIOMotorClient(MONGO_URL)
+    app.state.log_listener = setup_logging()
+    app.mongodb_client = AsyncMongoClient(MONGO_URL)
     app.mongodb = app.mongodb_client.get_database("radio_db")
-    print(f"Connected to MongoDB at {MONGO_URL}")
+    logger.info("Connected to MongoDB at %s", MONGO_URL)
+    try:
+        await ensure_favorites_index(app.mongodb.favorites)
+    except PyMongoError:
+        # Station endpoints don't need MongoDB, so keep serving without the index
+        logger.exception("Could not build the favorites index")
+    app.state.rb_base = await pick_radio_browser_mirror()
+    logger.info("Using Radio-Browser mirror %s", app.state.rb_base)
+    # Shared HTTP client so keep-alive connections to Radio-Browser are reused
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        base_url=app.state.rb_base,
+    )
+    app.state.upstream_sem = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY)
+    app.state.redis = aioredis.from_url(REDIS_URL)
+    app.state.release_lock = app.state.redis.register_script(RELEASE_LOCK_SCRIPT)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    app.mongodb_client.close()
+    await app.mongodb_client.close()
+    await app.state.http.aclose()
+    await app.state.redis.aclose()
+    app.state.log_listener.stop()
 
 # Data models
 class RadioStation(BaseModel):
@@ -51,6 +192,169 @@ class FavoriteStation(BaseModel):
     country: str
     added_at: Optional[datetime] = None
 
+def filter_stations(stations: List[dict]):
+    """Drop stations with empty URLs and keep only the fields clients use"""
+    return [
+        {
+            "stationuuid": s["stationuuid"],
+            "name": s["name"],
+            "url": s.get("url", ""),
+            "url_resolved": s["url_resolved"],
+            "country": s.get("country", ""),
+            "countrycode": s.get("countrycode", ""),
+            "tags": s.get("tags", ""),
+            "favicon": s.get("favicon", ""),
+            "bitrate": s.get("bitrate", 0),
+            "codec": s.get("codec", ""),
+            "clickcount": s.get("clickcount", 0)
+        }
+        for s in stations if s.get('url_resolved') and s.get('name')
+    ]
+
+async def search_upstream(client: httpx.AsyncClient, params: dict):
+    """Query Radio-Browser station search, revalidating a stored copy with If-None-Match"""
+    redis = app.state.redis
+    key = f"upstream:{urlencode(sorted(params.items()))}"
+    etag_key = f"etag:{key}"
+    try:
+        etag, cached = await redis.mget(etag_key, key)
+    except RedisError as e:
+        logger.warning("Redis unavailable, skipping revalidation for %s: %s", key, e)
+        etag = cached = None
+    
+    headers = {"If-None-Match": etag.decode()} if etag and cached is not None else {}
+    async with app.state.upstream_sem:
+        response = await client.get("/json/stations/search", params=params, headers=headers)
+    if response.status_code == 304:
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.expire(key, UPSTREAM_ETAG_TTL)
+                pipe.expire(etag_key, UPSTREAM_ETAG_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Error extending cache for %s: %s", key, e)
+        return orjson.loads(cached)
+    
+    response.raise_for_status()
+    stations = filter_stations(response.json())
+    etag = response.headers.get("etag")
+    if etag:
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, orjson.dumps(stations), ex=UPSTREAM_ETAG_TTL)
+                pipe.set(etag_key, etag, ex=UPSTREAM_ETAG_TTL)
+                await pipe.execute()
+        except RedisError as e:
+            logger.warning("Error writing cache for %s: %s", key, e)
+    return stations
+
+async def fetch_country(client: httpx.AsyncClient, country: str, limit: int, search: Optional[str] = None):
+    """Fetch the top stations for a single country from Radio-Browser"""
+    params = {
+        "country": country,
+        "limit": limit,
+        "order": "clickcount",
+        "reverse": "true"
+    }
+    if search:
+        params["name"] = search
+    
+    valid_stations = await search_upstream(client, params)
+    return valid_stations[:10]  # Take top 10 from each country
+
+async def fetch_top_stations(client: httpx.AsyncClient, limit: int):
+    """Fetch the most clicked stations worldwide in one call and keep those from our countries"""
+    params = {
+        "limit": limit * 4,  # Over-fetch since stations outside our countries are dropped
+        "order": "clickcount",
+        "reverse": "true"
+    }
+    valid_stations = await search_upstream(client, params)
+    return [s for s in valid_stations if s.get("countrycode") in ALL_COUNTRY_CODES][:limit]
+
+async def fetch_stations(countries: Sequence[str], limit: int, search: Optional[str] = None, top_worldwide: bool = False):
+    """Fetch and rank stations for the given countries from Radio-Browser.
+
+    Returns the stations and whether any upstream call succeeded.
+    """
+    client = app.state.http
+    if top_worldwide:
+        try:
+            return await asyncio.wait_for(fetch_top_stations(client, limit), timeout=COUNTRY_FETCH_TIMEOUT), True
+        except (httpx.HTTPError, asyncio.TimeoutError) as e:
+            logger.warning("Error fetching top stations: %r", e)
+            return [], False
+    
+    # Keyed by stationuuid so stations returned for several countries are merged once
+    all_stations: Dict[str, dict] = {}
+    
+    # Fetch stations for each country concurrently
+    per_country_limit = max(5, limit // len(countries))
+    tasks = [
+        asyncio.wait_for(
+            fetch_country(client, country, per_country_limit, search),
+            timeout=COUNTRY_FETCH_TIMEOUT
+        )
+        for country in countries[:MAX_COUNTRIES_PER_REQUEST]
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    any_succeeded = False
+    for country, result in zip(countries, results):
+        if isinstance(result, BaseException):
+            logger.warning("Error fetching stations for %s: %s", country, result)
+            continue
+        any_succeeded = True
+        for station in result:
+            all_stations.setdefault(station["stationuuid"], station)
+    
+    # Keep the top stations by click count
+    top_stations = heapq.nlargest(limit, all_stations.values(), key=lambda x: x.get('clickcount', 0))
+    return top_stations, any_succeeded
+
+async def cached_fetch_stations(key: str, countries: Sequence[str], limit: int, search: Optional[str] = None, top_worldwide: bool = False):
+    """Serve stations from Redis, refreshing through a single-flight lock on a miss"""
+    redis = app.state.redis
+    lock_key = f"lock:{key}"
+    token = secrets.token_hex(16)
+    have_lock = False
+    try:
+        # Only one request refreshes an expired key; the others wait for it and
+        # take over the lock if the holder finishes without filling the cache
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STATIONS_LOCK_TTL
+        while True:
+            cached = await redis.get(key)
+            if cached is not None:
+                return orjson.loads(cached)
+            have_lock = await redis.set(lock_key, token, nx=True, ex=STATIONS_LOCK_TTL)
+            if have_lock:
+                break
+            if loop.time() >= deadline:
+                logger.warning("Timed out waiting for cache lock %s, fetching directly", lock_key)
+                break
+            await asyncio.sleep(STATIONS_LOCK_POLL_INTERVAL)
+    except RedisError as e:
+        logger.warning("Redis unavailable, skipping cache for %s: %s", key, e)
+        result, _ = await fetch_stations(countries, limit, search, top_worldwide)
+        return result
+    
+    try:
+        result, any_succeeded = await fetch_stations(countries, limit, search, top_worldwide)
+        # Don't pin an outage's empty list for the TTL; genuine no-match results are cached
+        if any_succeeded:
+            ttl = STATIONS_CACHE_TTL if result else EMPTY_STATIONS_CACHE_TTL
+            try:
+                await redis.set(key, orjson.dumps(result), ex=ttl)
+            except RedisError as e:
+                logger.warning("Error writing cache for %s: %s", key, e)
+        return result
+    finally:
+        if have_lock:
+            try:
+                await app.state.release_lock(keys=[lock_key], args=[token])
+            except RedisError as e:
+                logger.warning("Error releasing cache lock %s: %s", lock_key, e)
+
 # API endpoints
 @app.get("/")
 async def root():
@@ -64,51 +368,21 @@ async def get_radio_stations(
 ):
     """Fetch radio stations from Radio-Browser API focusing on American and African stations"""
     try:
-        # Define American and African countries
-        american_countries = ["United States", "Canada", "Mexico", "Brazil", "Argentina", "Chile"]
-        african_countries = ["South Africa", "Nigeria", "Kenya", "Ghana", "Egypt", "Morocco", "Ethiopia", "Tanzania", "Uganda", "Zimbabwe"]
-        
+        top_worldwide = False
         if region == "american":
-            countries = american_countries
+            countries = AMERICAN_COUNTRIES
         elif region == "african":
-            countries = african_countries
+            countries = AFRICAN_COUNTRIES
         else:
-            countries = american_countries + african_countries
-        
-        all_stations = []
+            countries = ALL_COUNTRIES
+            # Without a search term one server-side ordered query covers every country
+            top_worldwide = not search
         
-        # Fetch stations for each country
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            for country in countries[:6]:  # Limit to avoid timeout
-                try:
-                    params = {
-                        "country": country,
-                        "limit": max(5, limit // len(countries)),
-                        "order": "clickcount",
-                        "reverse": "true"
-                    }
-                    if search:
-                        params["name"] = search
-                    
-                    response = await client.get(
-                        "https://de1.api.radio-browser.info/json/stations/search",
-                        params=params
-                    )
-                    if response.status_code == 200:
-                        stations = response.json()
-                        # Filter out stations with empty URLs
-                        valid_stations = [s for s in stations if s.get('url_resolved') and s.get('name')]
-                        all_stations.extend(valid_stations[:10])  # Take top 10 from each country
-                except Exception as e:
-                    print(f"Error fetching stations for {country}: {e}")
-                    continue
-        
-        # Sort by click count and limit results
-        all_stations.sort(key=lambda x: x.get('clickcount', 0), reverse=True)
-        return all_stations[:limit]
+        key = f"stations:{region}:{limit}:{search or ''}"
+        return await cached_fetch_stations(key, countries, limit, search, top_worldwide)
         
     except Exception as e:
-        print(f"Error in get_radio_stations: {e}")
+        logger.exception("Error in get_radio_stations: %s", e)
         raise HTTPException(status_code=500, detail=f"Error fetching stations: {str(e)}")
 
 @app.get("/api/stations/by-region/{region}")
@@ -125,17 +399,50 @@ async def search_stations(q: str, region: str = "all", limit: int = 20):
 async def add_favorite_station(favorite: FavoriteStation):
     """Add station to user favorites"""
     try:
-        favorite.added_at = datetime.utcnow()
-        existing = await app.mongodb.favorites.find_one({
-            "user_id": favorite.user_id,
-            "station_uuid": favorite.station_uuid
-        })
+        favorite.added_at = datetime.now(timezone.utc)
+        try:
+            result = await app.mongodb.favorites.update_one(
+                {"user_id": favorite.user_id, "station_uuid": favorite.station_uuid},
+                {"$setOnInsert": favorite.model_dump()},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Lost a race with a concurrent upsert of the same favorite
+            return {"message": "Station already in favorites", "already_exists": True}
         
-        if existing:
+        if result.upserted_id is None:
             return {"message": "Station already in favorites", "already_exists": True}
+        return {"message": "Station added to favorites", "id": str(result.upserted_id), "already_exists": False}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/favorites/bulk")
+async def add_favorite_stations(favorites: List[FavoriteStation]):
+    """Add several stations to user favorites in a single round trip"""
+    if not favorites:
+        return {"message": "No stations to add", "added": 0, "existing": 0}
+    if len(favorites) > MAX_BULK_FAVORITES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_FAVORITES} stations can be added at once")
+    try:
+        added_at = datetime.now(timezone.utc)
+        operations = []
+        for favorite in favorites:
+            favorite.added_at = added_at
+            operations.append(UpdateOne(
+                {"user_id": favorite.user_id, "station_uuid": favorite.station_uuid},
+                {"$setOnInsert": favorite.model_dump()},
+                upsert=True
+            ))
+        try:
+            result = await app.mongodb.favorites.bulk_write(operations, ordered=False)
+            added = result.upserted_count
+        except BulkWriteError as e:
+            # Duplicate keys only mean a concurrent upsert of the same favorite won
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            added = e.details["nUpserted"]
         
-        result = await app.mongodb.favorites.insert_one(favorite.dict())
-        return {"message": "Station added to favorites", "id": str(result.inserted_id), "already_exists": False}
+        return {"message": "Stations added to favorites", "added": added, "existing": len(favorites) - added}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -143,11 +450,9 @@ async def add_favorite_station(favorite: FavoriteStation):
 async def get_user_favorites(user_id: str = "demo_user"):
     """Get user's favorite stations"""
     try:
-        favorites = await app.mongodb.favorites.find({"user_id": user_id}).to_list(100)
-        # Convert ObjectId to string for JSON serialization
-        for fav in favorites:
-            fav["_id"] = str(fav["_id"])
-        return favorites
+        # Exclude _id server-side so no ObjectId conversion is needed
+        cursor = app.mongodb.favorites.find({"user_id": user_id}, {"_id": 0})
+        return await cursor.to_list(length=None)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -169,10 +474,7 @@ async def remove_favorite(station_uuid: str, user_id: str = "demo_user"):
 @app.get("/api/countries")
 async def get_available_countries():
     """Get list of available countries"""
-    return {
-        "american": ["United States", "Canada", "Mexico", "Brazil", "Argentina", "Chile"],
-        "african": ["South Africa", "Nigeria", "Kenya", "Ghana", "Egypt", "Morocco", "Ethiopia", "Tanzania", "Uganda", "Zimbabwe"]
-    }
+    return Response(content=COUNTRIES_JSON, media_type="application/json")
 
 if __name__ == "__main__":
     import uvicorn
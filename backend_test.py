@@ -200,6 +200,87 @@ def test_favorites_system():
         print_error(f"  Error testing favorites system: {str(e)}")
         return False
 
+def test_bulk_favorites():
+    """Test adding several favorite stations at once, then listing and removing them"""
+    print_info("Testing bulk favorites...")
+    
+    stamp = int(time.time())
+    test_stations = [
+        {
+            "user_id": TEST_USER_ID,
+            "station_uuid": f"test-bulk-station-{stamp}-{i}",
+            "station_name": f"Test Bulk Radio Station {i}",
+            "country": "Test Country"
+        }
+        for i in range(3)
+    ]
+    station_uuids = {station["station_uuid"] for station in test_stations}
+    
+    try:
+        # 1. Add stations in bulk, including a duplicate of the first one
+        print_info("  Adding stations to favorites in bulk...")
+        add_response = requests.post(
+            f"{API_BASE_URL}/favorites/bulk",
+            json=test_stations + [test_stations[0]]
+        )
+        
+        if add_response.status_code != 200:
+            print_error(f"  Failed to bulk add favorites: {add_response.status_code} - {add_response.text}")
+            return False
+        
+        add_data = add_response.json()
+        if add_data.get("added") == len(test_stations) and add_data.get("existing") == 1:
+            print_success("  Successfully bulk added stations, duplicate reported as existing")
+        else:
+            print_error(f"  Unexpected response when bulk adding favorites: {add_data}")
+            return False
+        
+        # 2. Get user favorites
+        print_info("  Retrieving user favorites...")
+        get_response = requests.get(f"{API_BASE_URL}/favorites", params={"user_id": TEST_USER_ID})
+        
+        if get_response.status_code != 200:
+            print_error(f"  Failed to get favorites: {get_response.status_code} - {get_response.text}")
+            return False
+        
+        found = [fav.get("station_uuid") for fav in get_response.json() if fav.get("station_uuid") in station_uuids]
+        if sorted(found) == sorted(station_uuids):
+            print_success("  Successfully retrieved favorites, found each bulk station once")
+        else:
+            print_error(f"  Bulk stations missing or duplicated in favorites: {found}")
+            return False
+        
+        # 3. Remove the stations from favorites
+        print_info("  Removing bulk stations from favorites...")
+        for station_uuid in station_uuids:
+            delete_response = requests.delete(
+                f"{API_BASE_URL}/favorites/{station_uuid}",
+                params={"user_id": TEST_USER_ID}
+            )
+            if delete_response.status_code != 200:
+                print_error(f"  Failed to remove favorite: {delete_response.status_code} - {delete_response.text}")
+                return False
+        
+        # 4. Verify stations were removed
+        print_info("  Verifying bulk stations were removed...")
+        verify_response = requests.get(f"{API_BASE_URL}/favorites", params={"user_id": TEST_USER_ID})
+        
+        if verify_response.status_code != 200:
+            print_error(f"  Failed to verify favorites: {verify_response.status_code} - {verify_response.text}")
+            return False
+        
+        for fav in verify_response.json():
+            if fav.get("station_uuid") in station_uuids:
+                print_error("  Bulk station still found in favorites after deletion")
+                return False
+        
+        print_success("  Successfully verified bulk stations were removed from favorites")
+        return True
+        
+    except Exception as e:
+        print_error(f"  Error testing bulk favorites: {str(e)}")
+        return False
+
 def test_region_specific_endpoints():
     """Test region-specific endpoints"""
     print_info("Testing region-specific endpoints...")
@@ -278,6 +359,7 @@ def run_all_tests():
         "stations_endpoint": test_stations_endpoint(),
         "search_endpoint": test_search_endpoint(),
         "favorites_system": test_favorites_system(),
+        "bulk_favorites": test_bulk_favorites(),
         "region_specific_endpoints": test_region_specific_endpoints(),
         "countries_endpoint": test_countries_endpoint()
     }